@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from io import BytesIO
 import xlsxwriter
 from xlsxwriter.utility import xl_col_to_name
 import datetime
+import hashlib
+import json
+import math
+from collections.abc import Mapping
 
 st.set_page_config(page_title="Rate Maker Custom Margin")
 
@@ -12,6 +17,7 @@ WORKING_DAYS_PER_YEAR = 252.0
 MANAGEMENT_COST_PERCENTAGE = 0.0650
 FACILITIES_COST_PERCENTAGE = 0.0645
 ADMIN_COST_PERCENTAGE = 0.1475
+OVERHEAD_COST_PERCENTAGE = MANAGEMENT_COST_PERCENTAGE + FACILITIES_COST_PERCENTAGE + ADMIN_COST_PERCENTAGE
 
 # Default margins for specified brackets, adjustable by the user
 
@@ -40,6 +46,12 @@ WEIGHT_RATES = {
         ">=25": 19.0
     }
 }
+# Weights (lbs) covered by each average shipment weight category
+WEIGHT_CATEGORY_RANGES = {
+    "0 - 10": (1, 10),
+    "11 - 24": (11, 24),
+    ">=25": (25, 250)
+}
 # Terminals and their zone details
 terminals = {
     '50': 'SLOK(Backyard)',
@@ -57,6 +69,16 @@ name_to_zone_number = {v: k for k, v in terminals.items()}
 # Creating a sorted list of terminal names for the dropdown to display terminal names
 terminal_names = sorted(name_to_zone_number.keys())
 
+# R2 lanes are published under their 200-series zone numbers
+r2_column_names = {
+    'SLOK (Zone 100) - R2': 'SLOK (Zone 200) - R2',
+    'SLHA/PK/BA (Zone 110) - R2': 'SLHA/PK/BA (Zone 210) - R2',
+    'SLLN/WS/OR/HV (Zone 120) - R2': 'SLLN/WS/OR/HV (Zone 220) - R2',
+    'SLMT (Zone 130) - R2': 'SLMT (Zone 230) - R2',
+    'SLOT (Zone 135) - R2': 'SLOT (Zone 235) - R2',
+    'SLQC (Zone 140) - R2': 'SLQC (Zone 240) - R2'
+}
+
 # First mile zone details
 firstmile_zone_details = {
     '50': {
@@ -306,6 +328,86 @@ final_mile_costs = {
     }
 }
 
+# Rate tables a customer rate card can override, by name
+BASE_RATE_TABLES = {
+    'firstmile_zone_details': firstmile_zone_details,
+    'middle_mile_pickup_details': middle_mile_pickup_details,
+    'firstmile_variance_details': firstmile_variance_details,
+    'middle_mile_variance_details': middle_mile_variance_details,
+    'final_mile_variance_rates': final_mile_variance_rates,
+    'First_sort_costs': First_sort_costs,
+    'Final_sort_costs': Final_sort_costs,
+    'final_mile_costs': final_mile_costs,
+}
+
+# Customer rate cards: only the cells negotiated away from the base tables, e.g.
+# 'Acme Corp': {'firstmile_zone_details': {'110': {'pickup_cost': 550.0000}},
+#               'final_mile_costs': {'R1': {'SLOK': {'14-250': 8.5000}}}}
+customer_rate_cards = {}
+
+class LayeredRateTable(Mapping):
+    """Read-only view of a base rate table with a customer's override cells layered on top.
+    Nested tables are resolved on lookup, so the base table is shared and never copied."""
+    __slots__ = ('overrides', 'base')
+
+    def __init__(self, overrides, base):
+        self.overrides = overrides
+        self.base = base
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            value = self.overrides[key]
+            base_value = self.base.get(key)
+            if isinstance(value, Mapping) and isinstance(base_value, Mapping):
+                return LayeredRateTable(value, base_value)
+            return value
+        return self.base[key]
+
+    def __iter__(self):
+        yield from self.base
+        for key in self.overrides:
+            if key not in self.base:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+# Digest of the base tables, taken each time the script runs so edits to them invalidate cached rate sheets
+BASE_RATE_TABLES_DIGEST = hashlib.sha1(json.dumps(BASE_RATE_TABLES, sort_keys=True).encode()).hexdigest()[:16]
+
+# Stable fingerprint of a customer's rate card (base tables plus overrides), used in cache keys in place of the tables themselves
+def rate_card_fingerprint(customer):
+    overrides = customer_rate_cards.get(customer)
+    if not overrides:
+        return f'base-{BASE_RATE_TABLES_DIGEST}'
+    return f"{BASE_RATE_TABLES_DIGEST}-{hashlib.sha1(json.dumps(overrides, sort_keys=True).encode()).hexdigest()[:16]}"
+
+# Check that every override cell names an existing cell of the base table and holds a number
+def validate_rate_card_overrides(customer, overrides, base, path):
+    for key, value in overrides.items():
+        cell_path = f"{path}[{key!r}]"
+        if key not in base:
+            raise ValueError(f"Rate card for '{customer}' overrides {cell_path}, which is not in the base rate tables.")
+        if isinstance(base[key], Mapping):
+            if not isinstance(value, Mapping):
+                raise ValueError(f"Rate card for '{customer}' must override the cells under {cell_path}, not replace the whole table.")
+            validate_rate_card_overrides(customer, value, base[key], cell_path)
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"Rate card for '{customer}' sets {cell_path} to {value!r}; rate cells must be finite numbers.")
+
+# Resolve every rate table for a customer; customers without a card get the base tables
+def get_rate_card(customer):
+    overrides = customer_rate_cards.get(customer, {})
+    unknown_tables = set(overrides) - set(BASE_RATE_TABLES)
+    if unknown_tables:
+        raise ValueError(f"Rate card for '{customer}' overrides unknown tables: {', '.join(sorted(unknown_tables))}")
+    for name, table_overrides in overrides.items():
+        validate_rate_card_overrides(customer, table_overrides, BASE_RATE_TABLES[name], name)
+    return {
+        name: LayeredRateTable(overrides[name], base) if name in overrides else base
+        for name, base in BASE_RATE_TABLES.items()
+    }
+
 # Cost Functions # First Mile pickup Cost 
 def calculate_pickup_cost_with_variance(weight, user_selected_pickup_details, zone_variance_details):
     pcs_gaylord = user_selected_pickup_details['pcs_gaylord']
@@ -332,13 +434,13 @@ def calculate_pickup_cost_with_variance(weight, user_selected_pickup_details, zo
     return round(base_cost, 6)
 
 # Calculating sort cost
-def calculate_first_sort_cost(terminal, weight):
+def calculate_first_sort_cost(terminal, weight, first_sort_costs=First_sort_costs):
     if weight <= 4:
-        return First_sort_costs[terminal]['1-4']
+        return first_sort_costs[terminal]['1-4']
     elif weight <= 13:
-        return First_sort_costs[terminal]['5-13']
+        return first_sort_costs[terminal]['5-13']
     else:  
-        return First_sort_costs[terminal]['14-250']
+        return first_sort_costs[terminal]['14-250']
     
     # Middle mile cost calculation  
 def calculate_middle_mile_cost_with_variance(zone_code, weight, middle_mile_pickup_details, middle_mile_variance_details):
@@ -373,13 +475,13 @@ def calculate_middle_mile_cost_with_variance(zone_code, weight, middle_mile_pick
     return round(base_cost, 6)
 
 # Final sort cost calculation 
-def calculate_final_sort_cost(terminal, weight):
+def calculate_final_sort_cost(terminal, weight, final_sort_costs=Final_sort_costs):
     if weight <= 4:
-        return Final_sort_costs[terminal]['1-4']
+        return final_sort_costs[terminal]['1-4']
     elif weight <= 13:
-        return Final_sort_costs[terminal]['5-13']
+        return final_sort_costs[terminal]['5-13']
     else:  # Here weight is always less than or equal to 250
-        return Final_sort_costs[terminal]['14-250']
+        return final_sort_costs[terminal]['14-250']
     
 # Final mile cost calculation    
 def calculate_final_mile_cost_with_variance(terminal, rate_type, weight, final_mile_costs, final_mile_variance_rates):
@@ -409,69 +511,171 @@ def calculate_final_mile_cost_with_variance(terminal, rate_type, weight, final_m
     final_cost = max(0, adjusted_cost)
     return round(final_cost, 6)
 
-# Total cost calculation Function
-def calculate_costs(service_type, user_selected_zone, user_selected_pickup_details, firstmile_variance_details, firstmile_zone_details, final_mile_variance_rates, middle_mile_pickup_details, middle_mile_variance_details, final_mile_costs, custom_margins):
-    selected_zone_details = firstmile_zone_details.get(user_selected_zone)
-    if selected_zone_details is None:
-        st.error(f"Selected pickup zone '{user_selected_zone}' is not recognized.")
-        return None, None
-    
-    # Retrieve custom margins from the provided dictionary
-    custom_margins_dict = {bracket: margin / 100 for bracket, margin in custom_margins.items()}
-    
-    costs_df = pd.DataFrame(index=pd.RangeIndex(start=1, stop=251, name='Weight in lbs'))
+# Direct cost calculation Function: total direct cost per weight and lane, before overhead and margin
+def calculate_direct_costs(service_type, user_selected_zone, user_selected_pickup_details, firstmile_variance_details, final_mile_variance_rates, middle_mile_pickup_details, middle_mile_variance_details, final_mile_costs, first_sort_costs=First_sort_costs, final_sort_costs=Final_sort_costs):
+    direct_costs_df = pd.DataFrame(index=pd.RangeIndex(start=1, stop=251, name='Weight in lbs'))
     
     for weight in range(1, 251):
-        custom_margin = next((margin for (start, end), margin in custom_margins_dict.items() if start <= weight <= end), 0)
-        sale_rate_factor = 1 - custom_margin
-        margin_factor = 1 + custom_margin
-        
         for zone_code, terminal_name in terminals.items():
-            zone_variance_details = firstmile_variance_details[zone_code]
             pickup_cost = 0
             first_sort_cost = 0
             middle_mile_cost = 0
             final_sort_cost = 0
             final_mile_cost_r1 = 0
             final_mile_cost_r2 = 0
-            total_direct_cost_r1 = 0
-            total_direct_cost_r2 = 0
             
             if service_type == 'End to End':
                 pickup_cost = calculate_pickup_cost_with_variance(weight, user_selected_pickup_details, firstmile_variance_details[user_selected_zone])
-                first_sort_cost = calculate_first_sort_cost(terminal_name, weight)
+                first_sort_cost = calculate_first_sort_cost(terminal_name, weight, first_sort_costs)
                 middle_mile_cost = calculate_middle_mile_cost_with_variance(zone_code, weight, middle_mile_pickup_details, middle_mile_variance_details)
-                final_sort_cost = calculate_final_sort_cost(terminal_name, weight)
+                final_sort_cost = calculate_final_sort_cost(terminal_name, weight, final_sort_costs)
                 final_mile_cost_r1 = calculate_final_mile_cost_with_variance(terminal_name, 'R1', weight, final_mile_costs, final_mile_variance_rates)
                 if zone_code != '50':  # Zone 50 applies to R1 but not to R2
                     final_mile_cost_r2 = calculate_final_mile_cost_with_variance(terminal_name, 'R2', weight, final_mile_costs, final_mile_variance_rates)
 
             elif service_type == 'End to End without Pickup':
-                first_sort_cost = calculate_first_sort_cost(terminal_name, weight)
+                first_sort_cost = calculate_first_sort_cost(terminal_name, weight, first_sort_costs)
                 middle_mile_cost = calculate_middle_mile_cost_with_variance(zone_code, weight, middle_mile_pickup_details, middle_mile_variance_details)
-                final_sort_cost = calculate_final_sort_cost(terminal_name, weight)
+                final_sort_cost = calculate_final_sort_cost(terminal_name, weight, final_sort_costs)
                 final_mile_cost_r1 = calculate_final_mile_cost_with_variance(terminal_name, 'R1', weight, final_mile_costs, final_mile_variance_rates)
                 if zone_code != '50':
                     final_mile_cost_r2 = calculate_final_mile_cost_with_variance(terminal_name, 'R2', weight, final_mile_costs, final_mile_variance_rates)
 
             elif service_type == 'Final Mile Only':
-                final_sort_cost = calculate_final_sort_cost(terminal_name, weight)
+                final_sort_cost = calculate_final_sort_cost(terminal_name, weight, final_sort_costs)
                 final_mile_cost_r1 = calculate_final_mile_cost_with_variance(terminal_name, 'R1', weight, final_mile_costs, final_mile_variance_rates)
                 if zone_code != '50':
                     final_mile_cost_r2 = calculate_final_mile_cost_with_variance(terminal_name, 'R2', weight, final_mile_costs, final_mile_variance_rates)
 
-            total_direct_cost_r1 = pickup_cost + first_sort_cost + middle_mile_cost + final_sort_cost + final_mile_cost_r1
             if final_mile_cost_r2:
-                total_direct_cost_r2 = pickup_cost + first_sort_cost + middle_mile_cost + final_sort_cost + final_mile_cost_r2
-                overhead_cost_r2 = total_direct_cost_r2 + (total_direct_cost_r2 / sale_rate_factor * (MANAGEMENT_COST_PERCENTAGE + FACILITIES_COST_PERCENTAGE + ADMIN_COST_PERCENTAGE))
-                final_cost_r2 = overhead_cost_r2 * margin_factor
-                costs_df.at[weight, f'{terminal_name} (Zone {zone_code}) - R2'] = final_cost_r2
+                direct_costs_df.at[weight, f'{terminal_name} (Zone {zone_code}) - R2'] = pickup_cost + first_sort_cost + middle_mile_cost + final_sort_cost + final_mile_cost_r2
+            direct_costs_df.at[weight, f'{terminal_name} (Zone {zone_code}) - R1'] = pickup_cost + first_sort_cost + middle_mile_cost + final_sort_cost + final_mile_cost_r1
+
+    return direct_costs_df
 
-            overhead_cost_r1 = total_direct_cost_r1 + (total_direct_cost_r1 / sale_rate_factor * (MANAGEMENT_COST_PERCENTAGE + FACILITIES_COST_PERCENTAGE + ADMIN_COST_PERCENTAGE))
-            final_cost_r1 = overhead_cost_r1 * margin_factor
-            costs_df.at[weight, f'{terminal_name} (Zone {zone_code}) - R1'] = final_cost_r1
+# Bracket margin (as a fraction) for every weight; weights outside all brackets get no margin
+def margins_by_weight(weights, custom_margins):
+    custom_margins_dict = {bracket: margin / 100 for bracket, margin in custom_margins.items()}
+    return pd.Series(
+        [next((margin for (start, end), margin in custom_margins_dict.items() if start <= weight <= end), 0) for weight in weights],
+        index=weights
+    )
+
+# Sell rate = direct cost plus overhead on the sell rate, marked up by the bracket margin
+def apply_margins(direct_costs_df, custom_margins):
+    custom_margin = margins_by_weight(direct_costs_df.index, custom_margins)
+    sale_rate_factor = 1 - custom_margin
+    margin_factor = 1 + custom_margin
+    overhead_costs_df = direct_costs_df + (direct_costs_df.div(sale_rate_factor, axis=0) * OVERHEAD_COST_PERCENTAGE)
+    return overhead_costs_df.mul(margin_factor, axis=0)
+
+# Cached direct costs for a customer's rate card; the card is keyed by its fingerprint rather than hashed
+@st.cache_data(show_spinner=False, max_entries=1000)
+def calculate_rate_card_direct_costs(service_type, user_selected_zone, fingerprint, _rate_card):
+    return calculate_direct_costs(
+        service_type,
+        user_selected_zone,
+        _rate_card['firstmile_zone_details'].get(user_selected_zone, {}),
+        _rate_card['firstmile_variance_details'],
+        _rate_card['final_mile_variance_rates'],
+        _rate_card['middle_mile_pickup_details'],
+        _rate_card['middle_mile_variance_details'],
+        _rate_card['final_mile_costs'],
+        _rate_card['First_sort_costs'],
+        _rate_card['Final_sort_costs']
+    )
+
+# Rate sheet for a customer's rate card: cached direct costs with the current margins applied
+def calculate_rate_card_costs(service_type, user_selected_zone, custom_margins, fingerprint, rate_card):
+    if user_selected_zone not in rate_card['firstmile_zone_details']:
+        st.error(f"Selected pickup zone '{user_selected_zone}' is not recognized.")
+        return None
+    direct_costs_df = calculate_rate_card_direct_costs(service_type, user_selected_zone, fingerprint, rate_card)
+    return apply_margins(direct_costs_df, custom_margins)
+
+# Margin Solver
+# A bracket margin m turns a direct cost D into the sell rate D * sell_rate_factor(m), so every target
+# below reduces to a ratio of sell rate to direct cost.
+def sell_rate_factor(margin):
+    return (1 + OVERHEAD_COST_PERCENTAGE / (1 - margin)) * (1 + margin)
+
+# Closed-form inverse of sell_rate_factor: the smaller root of m^2 - (K + r) m + (r - 1 - K) = 0, K being the overhead percentage
+def margin_for_sell_rate_factor(ratio):
+    k_plus_r = OVERHEAD_COST_PERCENTAGE + ratio
+    return (k_plus_r - np.sqrt(k_plus_r ** 2 - 4 * (ratio - 1 - OVERHEAD_COST_PERCENTAGE))) / 2
+
+# Margins that hit a target sell rate at one reference weight per bracket, on the given lane.
+# targets maps a bracket to (reference weight, target sell rate); returns margins in percent.
+def solve_margins_for_sell_rates(direct_costs_df, lane, targets):
+    solved_margins = {}
+    for bracket, (reference_weight, target_rate) in targets.items():
+        if not bracket[0] <= reference_weight <= bracket[1]:
+            raise ValueError(f"Reference weight {reference_weight} lbs is outside the {bracket[0]}-{bracket[1]} lbs bracket.")
+        direct_cost = direct_costs_df.at[reference_weight, lane]
+        if pd.isna(direct_cost) or direct_cost <= 0:
+            raise ValueError(f"No direct cost for {lane} at {reference_weight} lbs.")
+        margin = margin_for_sell_rate_factor(target_rate / direct_cost)
+        if margin < 0:
+            floor_rate = direct_cost * sell_rate_factor(0)
+            raise ValueError(f"Target ${target_rate:.2f} at {reference_weight} lbs is below the zero-margin rate of ${floor_rate:.2f}.")
+        solved_margins[bracket] = float(margin * 100)
+    return solved_margins
+
+# Brackets the blended-rate solver may shift for weight_range: those with most of their weights inside it
+def brackets_in_weight_range(custom_margins, weight_range):
+    start, end = weight_range
+    return [
+        bracket for bracket in custom_margins
+        if 2 * (min(end, bracket[1]) - max(start, bracket[0]) + 1) > bracket[1] - bracket[0] + 1
+    ]
+
+# Shift the margins of the brackets lying mostly inside weight_range by one common amount so that the average
+# sell rate over those weights and all lanes equals target_rate; returns the full set of margins in percent.
+def solve_margins_for_blended_rate(direct_costs_df, custom_margins, weight_range, target_rate):
+    start, end = weight_range
+    blended_costs_df = direct_costs_df.loc[start:end]
+    cost_by_weight = blended_costs_df.sum(axis=1)
+    cell_count = blended_costs_df.count().sum()
+    brackets = brackets_in_weight_range(custom_margins, weight_range)
+    if not brackets:
+        raise ValueError(f"No margin bracket lies mostly within {start}-{end} lbs.")
+
+    # Direct cost per shifted bracket; every other weight keeps its current margin and stays fixed
+    bracket_by_weight = pd.Series(
+        [next(((bracket_start, bracket_end) for bracket_start, bracket_end in custom_margins if bracket_start <= weight <= bracket_end), None) for weight in cost_by_weight.index],
+        index=cost_by_weight.index
+    )
+    position_by_weight = bracket_by_weight.map(lambda bracket: brackets.index(bracket) if bracket in brackets else -1)
+    bracket_costs = cost_by_weight.groupby(position_by_weight).sum().reindex(range(len(brackets)), fill_value=0).to_numpy()
+    fixed_weights = position_by_weight == -1
+    fixed_revenue = (cost_by_weight[fixed_weights] * sell_rate_factor(margins_by_weight(cost_by_weight.index, custom_margins)[fixed_weights])).sum()
+    margins = np.array([custom_margins[bracket] / 100 for bracket in brackets])
+
+    def blended_rate(shift):
+        return (fixed_revenue + bracket_costs @ sell_rate_factor(margins + shift)) / cell_count
+
+    # blended_rate is increasing in the shift, so bisect between zero margin and just under 100% margin
+    low, high = -margins.min(), 1 - margins.max() - 1e-9
+    if target_rate < blended_rate(low):
+        raise ValueError(f"Target ${target_rate:.2f} is below the lowest achievable blended rate of ${blended_rate(low):.2f}.")
+    if target_rate > blended_rate(high):
+        raise ValueError(f"Target ${target_rate:.2f} cannot be reached with margins under 100%.")
+    for _ in range(100):
+        shift = (low + high) / 2
+        if blended_rate(shift) < target_rate:
+            low = shift
+        else:
+            high = shift
 
-    return costs_df
+    solved_margins = dict(custom_margins)
+    for bracket, margin in zip(brackets, margins + (low + high) / 2):
+        solved_margins[bracket] = float(margin * 100)
+    return solved_margins
+
+# Annual revenue target, converted to a blended rate per piece with the same volume formula as the revenue estimate
+def solve_margins_for_annual_revenue(direct_costs_df, custom_margins, weight_range, target_revenue, avg_shipments_per_day, avg_pieces_per_shipment):
+    target_rate = target_revenue / (avg_shipments_per_day * avg_pieces_per_shipment * WORKING_DAYS_PER_YEAR)
+    return solve_margins_for_blended_rate(direct_costs_df, custom_margins, weight_range, target_rate)
 
 
 def to_excel(user_inputs_df,df1, df2):
@@ -555,6 +759,7 @@ with st.form("input_form"):
     freight_pickup_service = st.selectbox("Does the freight need to be picked up from the customer location to the induction site?", ['Yes', 'No'], key='freight_pickup_service')
     sort_initial_freight = st.selectbox("Is sorting of initial mixed freight at the induction site required?", ['Yes', 'No'], key='sort_initial_freight')
     pick_up_location = st.selectbox("Pickup Zone", options=terminal_names, key='pick_up_location')
+    customer_rate_card = st.selectbox("Customer Rate Card", ['Standard'] + sorted(customer_rate_cards), key='customer_rate_card')
     #pick_up_schedule = st.text_input("Pickup Schedule", key='pick_up_schedule')
     #pick_up_timings = st.text_input("Pickup Timings", key='pick_up_timings')
     average_shipment_weight = st.selectbox("Average Shipment Weight (In Pounds)", ["0 - 10", "11 - 24", ">=25"], key='average_shipment_weight')
@@ -580,7 +785,12 @@ with st.form("input_form"):
             st.stop()
         user_selected_zone_name = pick_up_location
         user_selected_zone_number = name_to_zone_number[user_selected_zone_name]
-        user_selected_pickup_details = firstmile_zone_details.get(user_selected_zone_number)
+        try:
+            rate_card = get_rate_card(customer_rate_card)
+        except ValueError as error:
+            st.error(str(error))
+            st.stop()
+        user_selected_pickup_details = rate_card['firstmile_zone_details'].get(user_selected_zone_number)
         if user_selected_pickup_details:
             service_type = 'End to End' if freight_pickup_service == 'Yes' and sort_initial_freight == 'Yes' else \
                            'End to End without Pickup' if sort_initial_freight == 'Yes' else 'Final Mile Only'
@@ -592,10 +802,90 @@ with st.form("input_form"):
             st.write(f"Selected Sell Rate per Piece: ${rate_per_piece} based on average weight category '{average_shipment_weight}'")
             st.session_state['service_type'] = service_type
             st.session_state['user_selected_zone_number'] = user_selected_zone_number
+            st.session_state['selected_rate_card'] = customer_rate_card
+            st.session_state['selected_average_shipment_weight'] = average_shipment_weight
+            st.session_state['selected_avg_shipments_per_day'] = avg_shipments_per_day
+            st.session_state['selected_avg_pieces_per_shipment'] = avg_pieces_per_shipment
             #st.session_state['target_margin'] = 0  # Initialize with default margin
         else:
             st.error("No pickup details available for the selected zone.")
 
+# Margin Solver Form: solve the bracket margins for a target price instead of regenerating by hand
+if st.session_state.get('service_type') and st.session_state.get('user_selected_zone_number'):
+    solver_rate_card_name = st.session_state.get('selected_rate_card')
+    try:
+        solver_rate_card = get_rate_card(solver_rate_card_name)
+    except ValueError as error:
+        st.error(str(error))
+        st.stop()
+    solver_direct_costs_df = calculate_rate_card_direct_costs(
+        st.session_state['service_type'],
+        st.session_state['user_selected_zone_number'],
+        rate_card_fingerprint(solver_rate_card_name),
+        solver_rate_card
+    )
+    # Solve against the opportunity from the same accepted submit as the direct costs
+    solver_weight_category = st.session_state['selected_average_shipment_weight']
+    solver_shipments_per_day = st.session_state['selected_avg_shipments_per_day']
+    solver_pieces_per_shipment = st.session_state['selected_avg_pieces_per_shipment']
+    with st.form("margin_solver_form"):
+        st.markdown('<span style="font-size: 20px; font-weight: bold; font-style: italic;">Solve margins for a target price</span>', unsafe_allow_html=True)
+        solver_target = st.radio("Target", ["Sell rate at reference weights", "Blended rate", "Annual revenue"], key='solver_target', horizontal=True)
+        solver_lane = st.selectbox("Lane for sell rate targets", options=list(solver_direct_costs_df.columns), format_func=lambda column: r2_column_names.get(column, column), key='solver_lane')
+        sell_rate_targets = {}
+        for bracket in st.session_state.get('custom_margins', {}):
+            weight_column, rate_column = st.columns(2)
+            reference_weight = weight_column.number_input(
+                f"Reference weight for {bracket[0]}-{bracket[1]} lbs:",
+                value=bracket[0],
+                min_value=bracket[0],
+                max_value=bracket[1],
+                key=f'solver_weight_{bracket[0]}_{bracket[1]}'
+            )
+            target_sell_rate = rate_column.number_input(
+                "Target sell rate at reference weight ($, 0 keeps margin):",
+                value=0.0,
+                min_value=0.0,
+                step=0.25,
+                key=f'solver_rate_{bracket[0]}_{bracket[1]}'
+            )
+            if target_sell_rate > 0:
+                sell_rate_targets[bracket] = (reference_weight, target_sell_rate)
+        target_blended_rate = st.number_input(f"Target blended rate per piece over the '{solver_weight_category}' weight category ($):", value=0.0, min_value=0.0, step=0.25, key='solver_blended_rate')
+        target_annual_revenue = st.number_input("Target annual revenue ($):", value=0.0, min_value=0.0, step=1000.0, key='solver_annual_revenue')
+        submit_solver = st.form_submit_button("Solve Margins")
+
+        if submit_solver:
+            custom_margins = st.session_state.get('custom_margins', {})
+            weight_range = WEIGHT_CATEGORY_RANGES[solver_weight_category]
+            try:
+                if solver_target == "Sell rate at reference weights":
+                    if not sell_rate_targets:
+                        raise ValueError("Enter a target sell rate for at least one weight bracket.")
+                    solved_margins = {**custom_margins, **solve_margins_for_sell_rates(solver_direct_costs_df, solver_lane, sell_rate_targets)}
+                elif solver_target == "Blended rate":
+                    solved_margins = solve_margins_for_blended_rate(solver_direct_costs_df, custom_margins, weight_range, target_blended_rate)
+                else:
+                    solved_margins = solve_margins_for_annual_revenue(solver_direct_costs_df, custom_margins, weight_range, target_annual_revenue, solver_shipments_per_day, solver_pieces_per_shipment)
+            except ValueError as error:
+                st.error(str(error))
+            else:
+                st.session_state['custom_margins'] = solved_margins
+                # Drop the margin inputs' state so the margin form below picks up the solved values
+                for bracket in solved_margins:
+                    st.session_state.pop(f'margin_{bracket[0]}_{bracket[1]}', None)
+                st.session_state['costs_df'] = apply_margins(solver_direct_costs_df, solved_margins)
+                st.success("Margins solved and rate sheet updated.")
+                if solver_target != "Sell rate at reference weights":
+                    start, end = weight_range
+                    for bracket in brackets_in_weight_range(custom_margins, weight_range):
+                        if bracket[0] < start or bracket[1] > end:
+                            st.info(f"The {bracket[0]}-{bracket[1]} lbs margin was changed and also reprices weights outside the '{solver_weight_category}' category.")
+                st.dataframe(pd.DataFrame({
+                    'Weight bracket': [f"{bracket[0]}-{bracket[1]} lbs" for bracket in solved_margins],
+                    'Margin (%)': list(solved_margins.values())
+                }).style.format({'Margin (%)': "{:.2f}"}), hide_index=True)
+
 # Custom Margin Form
 with st.form("custom_margin_form"):
     st.markdown('<span style="font-size: 20px; font-weight: bold; font-style: italic;">Enter margin by Weight bracket below(%)</span>', unsafe_allow_html=True)
@@ -624,7 +914,13 @@ with st.form("custom_margin_form"):
         # Calculate Costs
         service_type = st.session_state.get('service_type')
         user_selected_zone_number = st.session_state.get('user_selected_zone_number')
-        user_selected_pickup_details = firstmile_zone_details.get(user_selected_zone_number, {})
+        customer_rate_card = st.session_state.get('selected_rate_card')
+        try:
+            rate_card = get_rate_card(customer_rate_card)
+        except ValueError as error:
+            st.error(str(error))
+            st.stop()
+        user_selected_pickup_details = rate_card['firstmile_zone_details'].get(user_selected_zone_number, {})
         custom_margins = st.session_state.get('custom_margins', {})  #Retrieving custom margins from session state
         if service_type and user_selected_zone_number and user_selected_pickup_details:
             target_margin_input = st.session_state.get('custom_margins', {}).get((0, 0), 0)  #Storing custom margin input in targetmargininput
@@ -632,17 +928,12 @@ with st.form("custom_margin_form"):
                     st.write("Selected Pickup Zone: NA")
             else:
                     st.write(f"Selected Pickup Zone: {st.session_state.get('pick_up_location')}")
-            costs_df = calculate_costs(
+            costs_df = calculate_rate_card_costs(
                 service_type,  
                 user_selected_zone_number, 
-                user_selected_pickup_details, 
-                firstmile_variance_details,
-                firstmile_zone_details, 
-                final_mile_variance_rates, 
-                middle_mile_pickup_details, 
-                middle_mile_variance_details, 
-                final_mile_costs,
-                custom_margins
+                custom_margins,
+                rate_card_fingerprint(customer_rate_card),
+                rate_card
             )
 
             if costs_df is not None:
@@ -660,6 +951,7 @@ user_inputs_dict = {
     'Freight Pickup Service': [freight_pickup_service],
     'Sort Initial Freight': [sort_initial_freight],
     'Pickup Location': [pick_up_location],
+    'Customer Rate Card': [st.session_state.get('selected_rate_card', customer_rate_card)],
     #'Pickup Schedule': [pick_up_schedule],
     #'Pickup Timings': [pick_up_timings],
     'Average Shipment Weight': [average_shipment_weight],
@@ -679,17 +971,8 @@ if 'costs_df' in st.session_state and st.session_state['costs_df'] is not None a
     r1_df = costs_df.filter(regex='R1')
     r2_df = costs_df.filter(regex='R2')
 
-    new_column_names = {
-        'SLOK (Zone 100) - R2': 'SLOK (Zone 200) - R2',
-        'SLHA/PK/BA (Zone 110) - R2': 'SLHA/PK/BA (Zone 210) - R2',
-        'SLLN/WS/OR/HV (Zone 120) - R2': 'SLLN/WS/OR/HV (Zone 220) - R2',
-        'SLMT (Zone 130) - R2': 'SLMT (Zone 230) - R2',
-        'SLOT (Zone 135) - R2': 'SLOT (Zone 235) - R2',
-        'SLQC (Zone 140) - R2': 'SLQC (Zone 240) - R2'
-    }
-
     # Rename the columns of r2_df
-    r2_df.rename(columns=new_column_names, inplace=True)
+    r2_df.rename(columns=r2_column_names, inplace=True)
 
     # Display opportunity name, service level, date, and time of generation
     opportunity_name = st.session_state.get('opportunity_name', 'N/A')
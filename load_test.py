@@ -0,0 +1,244 @@
+"""Concurrent-session load test for the Rate Maker app.
+
+Drives simulated rep sessions through the real form flow of RM1205.py (input form with a customer
+rate card, margin form, margin solver, R1 & R2 ratesheet export) with Streamlit's AppTest, and
+reports rerun latency percentiles, CPU use, resident memory and session-state memory per user at
+each concurrency level.
+
+    python load_test.py --sessions 1 2 4 8 16 --rounds 3 --csv timings.csv
+"""
+import argparse
+import ast
+import os
+import pickle
+import random
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+import streamlit.logger
+from streamlit import config
+from streamlit.testing.v1 import AppTest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILE = os.path.join(APP_DIR, 'RM1205.py')
+RERUN_TIMEOUT = 120
+
+# Synthetic customer rate cards registered for the run, so sessions also price layered overrides
+LOAD_TEST_RATE_CARDS = {
+    'Load Test Card A': {
+        'firstmile_zone_details': {'110': {'pickup_cost': 550.0}},
+        'final_mile_costs': {'R1': {'SLOK': {'14-250': 8.5}}},
+    },
+    'Load Test Card B': {
+        'middle_mile_pickup_details': {'120': {'Pickup Cost': 700.0}},
+        'Final_sort_costs': {'SLQC': {'1-4': 0.15}},
+        'final_mile_variance_rates': {'R2': {'SLMT': {'Upto 75 lbs': 0.12}}},
+    },
+}
+RATE_CARD_REGISTRY_LINE = 'customer_rate_cards = {}'
+
+with open(APP_FILE) as app_file:
+    APP_SOURCE = app_file.read()
+
+# App constants that never reach a widget are read from the app source, so the harness follows any change to them
+def app_constant(name):
+    for node in ast.parse(APP_SOURCE).body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == name for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise LookupError(f"{name} is not a literal assignment in {APP_FILE}")
+
+WEIGHT_CATEGORY_RANGES = app_constant('WEIGHT_CATEGORY_RANGES')
+WORKING_DAYS_PER_YEAR = app_constant('WORKING_DAYS_PER_YEAR')
+
+# The app with the synthetic rate cards in place of its (possibly empty) registry
+def load_test_app_source():
+    if APP_SOURCE.count(RATE_CARD_REGISTRY_LINE) != 1:
+        raise LookupError(f"Cannot find '{RATE_CARD_REGISTRY_LINE}' in {APP_FILE} to register the load test rate cards")
+    return APP_SOURCE.replace(RATE_CARD_REGISTRY_LINE, f'customer_rate_cards = {LOAD_TEST_RATE_CARDS!r}')
+
+# AppTest swaps process-wide runtime state on every run, so reruns within one process take turns.
+# This only approximates a single `streamlit run` server: the lock also serializes AppTest's own
+# element-tree work, and queueing behind it stands in for session threads contending for the GIL.
+rerun_lock = threading.Lock()
+
+
+# Time one rerun as the rep sees it, including the wait for the server to pick it up
+def timed_rerun(timings, step, rerun):
+    started = time.perf_counter()
+    with rerun_lock:
+        app = rerun()
+    timings.append((step, time.perf_counter() - started))
+    if app.exception:
+        raise RuntimeError(f"Rerun '{step}' failed: {app.exception[0].message}")
+    return app
+
+# Resident memory of the calling process, from /proc (Linux only)
+def current_rss_kb():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+
+def find_button(app, label):
+    return next(button for button in app.button if button.label == label)
+
+# Weight brackets of the margin form, from its margin_<start>_<end> inputs
+def margin_brackets(app):
+    return [tuple(int(weight) for weight in number_input.key.split('_')[1:]) for number_input in app.number_input if number_input.key.startswith('margin_')]
+
+def pick_option(app, rng, key):
+    app.selectbox(key=key).select(rng.choice(app.selectbox(key=key).options))
+
+# Approximate bytes held by a session-state value; DataFrames are measured deep, everything else pickled
+def state_value_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    try:
+        return len(pickle.dumps(value))
+    except Exception:
+        return sys.getsizeof(value)
+
+# Targets a little above the current rate sheet, so the solver always has a reachable answer
+def set_solver_target(app, rng, weight_category, annual_volume):
+    costs_df = app.session_state['costs_df']
+    solver_target = rng.choice(app.radio(key='solver_target').options)
+    app.radio(key='solver_target').set_value(solver_target)
+    uplift = rng.uniform(1.0, 1.3)
+    if solver_target == 'Sell rate at reference weights':
+        lane = rng.choice(list(costs_df.columns))
+        app.selectbox(key='solver_lane').select(lane)
+        for start, end in margin_brackets(app):
+            reference_weight = rng.randint(start, end)
+            if pd.notna(costs_df.at[reference_weight, lane]):
+                app.number_input(key=f'solver_weight_{start}_{end}').set_value(reference_weight)
+                app.number_input(key=f'solver_rate_{start}_{end}').set_value(round(costs_df.at[reference_weight, lane] * uplift, 2))
+    else:
+        start, end = WEIGHT_CATEGORY_RANGES[weight_category]
+        blended_rate = costs_df.loc[start:end].stack().mean() * uplift
+        if solver_target == 'Blended rate':
+            app.number_input(key='solver_blended_rate').set_value(round(blended_rate, 2))
+        else:
+            app.number_input(key='solver_annual_revenue').set_value(round(blended_rate * annual_volume, 2))
+
+# One rep: fill in the opportunity, then regenerate, solve and export the rate sheet `rounds` times
+def simulate_session(session_number, rounds):
+    rng = random.Random(session_number)
+    timings = []
+    peak_rss_kb = current_rss_kb()
+    cpu_started = time.process_time()
+
+    app = AppTest.from_string(load_test_app_source(), default_timeout=RERUN_TIMEOUT)
+    app = timed_rerun(timings, 'initial load', app.run)
+
+    app.text_input(key='opportunity_name').input(f"Load test {session_number}")
+    app.text_input(key='quote_prepared_by').input('load_test')
+    for key in ['freight_pickup_service', 'sort_initial_freight', 'pick_up_location', 'customer_rate_card', 'average_shipment_weight']:
+        pick_option(app, rng, key)
+    weight_category = app.selectbox(key='average_shipment_weight').value
+    shipments_per_day = rng.randint(50, 2000)
+    pieces_per_shipment = rng.randint(1, 4)
+    app.number_input(key='avg_shipments_per_day').set_value(shipments_per_day)
+    app.number_input(key='avg_pieces_per_shipment').set_value(pieces_per_shipment)
+    app = timed_rerun(timings, 'input form', find_button(app, 'Calculate Est. Annual Revenue').click().run)
+    if app.error:
+        raise RuntimeError(f"Input form failed: {app.error[0].value}")
+    annual_volume = shipments_per_day * pieces_per_shipment * WORKING_DAYS_PER_YEAR
+
+    for _ in range(rounds):
+        for start, end in margin_brackets(app):
+            app.number_input(key=f'margin_{start}_{end}').set_value(rng.choice(range(0, 60)) / 2)
+        app = timed_rerun(timings, 'margin form', find_button(app, 'Generate Rate Sheet').click().run)
+        set_solver_target(app, rng, weight_category, annual_volume)
+        app = timed_rerun(timings, 'margin solver', find_button(app, 'Solve Margins').click().run)
+        if app.error:
+            raise RuntimeError(f"Margin solver failed: {app.error[0].value}")
+        app = timed_rerun(timings, 'export', find_button(app, 'Prepare R1 & R2 Ratesheet').click().run)
+        peak_rss_kb = max(peak_rss_kb, current_rss_kb())
+
+    state_bytes = sum(state_value_size(value) for value in app.session_state.filtered_state.values())
+    return timings, state_bytes, time.process_time() - cpu_started, os.getpid(), peak_rss_kb
+
+# Run `sessions` reps at once and summarize their reruns; rss_before_kb is the resident memory to measure growth from, if known
+def run_level(sessions, rounds, use_processes, rss_before_kb):
+    st.cache_data.clear()  # every level starts cold, like a freshly started server
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    with executor_class(max_workers=sessions) as executor:
+        results = list(executor.map(simulate_session, range(sessions), [rounds] * sessions))
+    wall_seconds = time.perf_counter() - wall_started
+
+    if use_processes:
+        cpu_seconds = sum(session_cpu for _, _, session_cpu, _, _ in results)
+    else:
+        cpu_seconds = time.process_time() - cpu_started
+    # Peak resident memory this level: the highest sample per process, summed over the processes serving sessions
+    peak_rss_by_process = {}
+    for _, _, _, pid, peak_rss_kb in results:
+        peak_rss_by_process[pid] = max(peak_rss_by_process.get(pid, 0), peak_rss_kb)
+    rss_kb = sum(peak_rss_by_process.values())
+
+    timings = pd.DataFrame(
+        [(sessions, session_number, step, seconds) for session_number, (session_timings, _, _, _, _) in enumerate(results) for step, seconds in session_timings],
+        columns=['sessions', 'session', 'step', 'seconds']
+    )
+    latency_ms = timings['seconds'] * 1000
+    summary = {
+        'sessions': sessions,
+        'reruns': len(timings),
+        'p50 ms': latency_ms.quantile(0.50),
+        'p90 ms': latency_ms.quantile(0.90),
+        'p99 ms': latency_ms.quantile(0.99),
+        'max ms': latency_ms.max(),
+        'reruns/s': len(timings) / wall_seconds,
+        'CPU %': 100 * cpu_seconds / wall_seconds,
+        'state KB/user': sum(state_bytes for _, state_bytes, _, _, _ in results) / sessions / 1024,
+        'RSS MB': rss_kb / 1024,
+        'RSS growth MB': (rss_kb - rss_before_kb) / 1024 if rss_before_kb is not None else float('nan'),
+    }
+    return summary, timings, rss_kb
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test RM1205.py with concurrent simulated rep sessions.")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8], help="concurrency levels to run, in order")
+    parser.add_argument('--rounds', type=int, default=3, help="margin, solver and export cycles per session")
+    parser.add_argument('--processes', action='store_true', help="run each session in its own process instead of sharing one server process")
+    parser.add_argument('--csv', help="write every rerun timing to this CSV file")
+    args = parser.parse_args()
+
+    # The app loads logo.png relative to its own folder
+    os.chdir(APP_DIR)
+    # Keep the report readable: Streamlit warns about running without a server, and the app about pandas copies.
+    # set_log_level also applies to the runtime and script-run loggers Streamlit creates later.
+    config.set_option('logger.level', 'error')
+    streamlit.logger.set_log_level('error')
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+
+    summaries = []
+    all_timings = []
+    # Growth is measured from the level before; the first level of a shared-process run starts from the idle harness,
+    # while separate worker processes have no comparable idle baseline
+    rss_kb = None if args.processes else current_rss_kb()
+    for sessions in args.sessions:
+        summary, timings, rss_kb = run_level(sessions, args.rounds, args.processes, rss_kb)
+        summaries.append(summary)
+        all_timings.append(timings)
+        print(f"{sessions} concurrent sessions: p50 {summary['p50 ms']:.0f} ms, p99 {summary['p99 ms']:.0f} ms", flush=True)
+
+    print()
+    print(pd.DataFrame(summaries).to_string(index=False, float_format=lambda value: f"{value:.1f}"))
+    print()
+    print("Latency by step (ms):")
+    step_latency_ms = pd.concat(all_timings).assign(ms=lambda frame: frame['seconds'] * 1000)
+    print(step_latency_ms.groupby(['sessions', 'step'])['ms'].describe(percentiles=[0.5, 0.9, 0.99])[['count', '50%', '90%', '99%', 'max']].to_string(float_format=lambda value: f"{value:.1f}"))
+
+    if args.csv:
+        pd.concat(all_timings).to_csv(args.csv, index=False)
+
+
+if __name__ == '__main__':
+    main()